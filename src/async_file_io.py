@@ -0,0 +1,24 @@
+"""
+async_file_io.py: Event-loop native versions of the file tools.
+
+Reads go through aiofile, whose caio backend submits them to the kernel's asynchronous
+I/O interface on Linux (with a thread-pool fallback elsewhere). Several reads issued in
+the same model turn are then in flight together without tying up one thread each.
+"""
+from aiofile import async_open
+
+from src.tools import _resolve_readable_file
+
+
+# --- Async Tool Functions ---
+async def read_file(path: str) -> str:
+    """Reads the content of a file at the given path."""
+    print(f"\n⚒️ Tool: Reading file: {path}")
+    try:
+        target_path, error = _resolve_readable_file(path)
+        if target_path is None:
+            return error
+        async with async_open(target_path, "r") as afp:
+            return await afp.read()
+    except Exception as e:
+        return f"Error reading file: {e}"
@@ -0,0 +1,51 @@
+"""
+llm_cache.py: Disk-backed cache of model replies, so repeated prompts skip the LLM round trip.
+
+Entries are keyed by a (blake3) hash of everything that determines the reply: the model, the
+conversation history plus the new prompt, the sampling temperature and the tool names.
+"""
+from pathlib import Path
+
+import diskcache
+import orjson
+from blake3 import blake3
+
+# --- Defaults ---
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "coding-agent"
+DEFAULT_EXPIRE_SECONDS = 7 * 24 * 3600  # Drop entries after a week
+
+
+class LLMCache:
+    """Exact-match response cache stored under ``~/.cache/coding-agent``."""
+
+    def __init__(self, directory: Path = DEFAULT_CACHE_DIR, expire: int | None = DEFAULT_EXPIRE_SECONDS):
+        self.expire = expire
+        self._cache = diskcache.Cache(str(directory))
+
+    @staticmethod
+    def cache_key(model: str, messages: list, temperature: float = 0, tools: list[str] | None = None) -> str:
+        """Builds a cache key from the request parameters.
+
+        Args:
+            model: The model name the request is sent to.
+            messages: JSON-serializable conversation history, ending with the new prompt.
+            temperature: Sampling temperature of the request.
+            tools: Names of the tools available to the model.
+
+        Returns:
+            A hex digest identifying the request.
+        """
+        payload = {"model": model, "messages": messages, "temperature": temperature, "tools": tools or []}
+        return blake3(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """Returns the cached entry for ``key``, or None on a miss."""
+        return self._cache.get(key)
+
+    def set(self, key: str, value: dict) -> None:
+        """Stores ``value`` under ``key``."""
+        self._cache.set(key, value, expire=self.expire)
+
+    def close(self) -> None:
+        """Closes the underlying cache database."""
+        self._cache.close()
@@ -1,46 +1,213 @@
 import argparse
+import asyncio
+import collections
+import concurrent.futures
 import functools
+import inspect
 import logging
 import os
+import re
 import sys
+import time
 import traceback
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from google import genai
-from google.genai import types
-
-from src.tools import (
-    edit_file,
-    execute_bash_command,
-    find_arxiv_papers,
-    get_current_date_and_time,
-    google_search,
-    list_files,
-    open_url,
-    read_file,
-    run_in_sandbox,
-    upload_pdf_for_gemini,
-)
+# The Gemini SDK, the tools and the response cache pull in heavy dependencies (protobuf,
+# auth, docker, browser automation...), so they are imported lazily where first needed.
+# This keeps `coding-agent --help` and early error paths fast.
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
 # Choose your Gemini model - unless you want something crazy "gemini-2.5-flash-preview-04-17" is the default model
 MODEL_NAME = "gemini-2.5-flash-preview-04-17"
 DEFAULT_THINKING_BUDGET = 256
-
-# Define project root - needed here for agent initialization
-project_root = Path(__file__).resolve().parents[1]
+TOKEN_COUNT_CACHE_SIZE = 4096  # Max number of per-message token counts kept in memory
+CONTEXT_CACHE_TTL_SECONDS = 3600  # Lifetime of the server-side cache holding the tool declarations
+CONTEXT_CACHE_TTL = f"{CONTEXT_CACHE_TTL_SECONDS}s"
+CONTEXT_CACHE_REFRESH_SECONDS = 300  # Extend the context cache when less than this is left of it
+CONTEXT_CACHE_MIN_TOKENS = 1024  # Smallest explicit context cache Gemini 2.5 Flash accepts
+CHARS_PER_TOKEN = 4  # Rough ratio, used to estimate the size of the tool declarations
+MAX_REMOTE_CALLS = 8  # Max tool round trips per message, like AFC's maximum_remote_calls
+TOOL_MAX_WORKERS = 8  # Max tool calls of a single model turn running at the same time
+# Tools without side effects; only these may run concurrently within a model turn
+READ_ONLY_TOOLS = frozenset(
+    {"read_file", "list_files", "google_search", "open_url", "find_arxiv_papers", "get_current_date_and_time"}
+)
+TOOL_RESULT_COMPACT_BYTES = 2048  # Tool results larger than this are summarized in the kept history
+TOOL_RESULT_SUMMARY_CHARS = 512  # Characters of a compacted tool result kept in the history
+
+# Terminal output prefixes (ANSI colors), so each message is written with a single call
+AGENT_PREFIX = "\n🟢 \x1b[92mAgent:\x1b[0m "
+ERR_PREFIX = "\n🔴 \x1b[91m"
+WARN_PREFIX = "\n⚠️ \x1b[93m"
+ANSI_RESET = "\x1b[0m"
+
+
+def _write(text: str) -> None:
+    """Writes text to stdout in one call and flushes it."""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def _serialize_content(content: "types.Content") -> bytes:
+    """Serializes a Content to canonical (key-sorted) JSON bytes."""
+    import orjson
+
+    return orjson.dumps(content.model_dump(mode="json", exclude_none=True), option=orjson.OPT_SORT_KEYS)
+
+
+def _content_hash(serialized: bytes) -> str:
+    """Returns a hash of a serialized Content, used as a token-count cache key."""
+    from blake3 import blake3
+
+    return blake3(serialized).hexdigest()
+
+
+def _build_batch_prompt(prompts: list[str]) -> str:
+    """Combines several independent prompts into one numbered request."""
+    numbered = "\n".join(f"{i}. {prompt}" for i, prompt in enumerate(prompts, start=1))
+    return (
+        "Answer each of the following requests independently. Start each answer on a new line "
+        "with its number followed by a period (e.g. '1. '), in the same order.\n" + numbered
+    )
+
+
+def _split_numbered_answers(text: str, count: int) -> list[str] | None:
+    """Splits a numbered response into ``count`` answers, or returns None if it doesn't match.
+
+    Only numbers at the start of a line can begin an answer, so indented sub-lists are
+    left alone. Other numbers that don't continue the 1..count sequence stay part of
+    the current answer, including an unindented list inside it that restarts at 1.
+    """
+    markers = [(int(match.group(1)), match) for match in re.finditer(r"(?m)^(\d+)[.)]\s+", text)]
+    starts = []
+    nested = None  # Last item number of a numbered list inside the current answer
+    for i, (number, match) in enumerate(markers):
+        expected = len(starts) + 1
+        if expected > count:
+            break
+        if starts and number == 1:
+            nested = 1
+        elif nested is not None and number == nested + 1 and any(n == expected for n, _ in markers[i + 1 :]):
+            # Continues the inner list; the next answer's number still comes later
+            nested = number
+        elif number == expected:
+            starts.append(match)
+            nested = None
+    if len(starts) != count:
+        return None
+    ends = [match.start() for match in starts[1:]] + [len(text)]
+    return [text[match.end() : end].strip() for match, end in zip(starts, ends, strict=True)]
+
+
+def _compact_tool_results(history: list) -> tuple[list, bool]:
+    """Replaces large tool results in ``history`` with short summaries.
+
+    The full result is not kept anywhere; the model can call the tool again if it
+    needs it. Only function responses are touched; user and model text is kept as is.
+
+    Returns:
+        The compacted history and whether anything was changed.
+    """
+    changed = False
+    compacted = []
+    for content in history:
+        content_changed = False
+        parts = []
+        for part in content.parts or []:
+            function_response = part.function_response
+            result = (function_response.response or {}).get("result") if function_response else None
+            data = result.encode() if isinstance(result, str) else b""
+            if len(data) > TOOL_RESULT_COMPACT_BYTES:
+                summary = f"{result[:TOOL_RESULT_SUMMARY_CHARS]}...<truncated, {len(data)} bytes in full>"
+                function_response = function_response.model_copy(update={"response": {"summary": summary}})
+                part = part.model_copy(update={"function_response": function_response})
+                content_changed = True
+            parts.append(part)
+        compacted.append(content.model_copy(update={"parts": parts}) if content_changed else content)
+        changed = changed or content_changed
+    return compacted, changed
+
+
+_clients = {}  # API key -> (event loop, genai.Client), see _get_client
+_uncacheable_models = set()  # Models whose caches.create failed in this process
+
+
+def _get_client(api_key: str) -> "genai.Client":
+    """Returns the shared genai.Client for ``api_key`` on the running event loop.
+
+    Agents using the same key reuse one client and its connection pool and auth state,
+    instead of setting up a new one each. The client is safe to use concurrently. Its
+    aio connections belong to the loop they were opened on, so a new client is created
+    when called from another loop (e.g. a later ``asyncio.run``).
+    """
+    from google import genai
+
+    loop = asyncio.get_running_loop()
+    cached = _clients.get(api_key)
+    if cached is None or cached[0] is not loop:
+        cached = _clients[api_key] = (loop, genai.Client(api_key=api_key))
+    return cached[1]
+
+
+@functools.cache
+def _tool_declarations(tool_functions: tuple) -> "types.Tool":
+    """Returns a Tool with the FunctionDeclarations of ``tool_functions``.
+
+    Building declarations introspects each callable's signature and type hints, so the
+    result is computed once per process and shared by every agent and session.
+    """
+    from google.genai import types
+
+    return types.Tool(
+        function_declarations=[
+            types.FunctionDeclaration.from_callable_with_api_option(callable=f) for f in tool_functions
+        ]
+    )
 
 
 # --- Code Agent Class ---
 class CodeAgent:
     """A simple coding agent using Google Gemini (google-genai SDK)."""
 
-    def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash-preview-04-17", verbose: bool = False):
-        """Initializes the agent with API key and model name."""
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = "gemini-2.5-flash-preview-04-17",
+        verbose: bool = False,
+        use_cache: bool = True,
+        session_path: Path | None = None,
+    ):
+        """Initializes the agent with API key and model name.
+
+        If ``session_path`` is given, the chat history is restored from it on start and
+        written back to it when the session ends.
+        """
+        from google.genai import types
+
+        from src.async_file_io import read_file as read_file_async
+        from src.tools import (
+            edit_file,
+            execute_bash_command,
+            find_arxiv_papers,
+            get_current_date_and_time,
+            google_search,
+            list_files,
+            open_url,
+            read_file,
+            run_in_sandbox,
+        )
+
+        self._types = types
         self.api_key = api_key
         self.verbose = verbose
+        self.use_cache = use_cache
+        self.session_path = session_path
         self.model_name = f"models/{model_name}"  # Add 'models/' prefix
         # Use imported tool functions
-        self.tool_functions = [
+        tool_functions = (
             read_file,
             list_files,
             edit_file,
@@ -50,187 +217,627 @@ class CodeAgent:
             get_current_date_and_time,
             google_search,
             open_url,
-        ]
+        )
+        # Declarations come from the undecorated functions, so they are shared with verbose agents
+        self.tool = _tool_declarations(tool_functions)
+        self.tool_functions = list(tool_functions)
         if self.verbose:
             self.tool_functions = [self._make_verbose_tool(f) for f in self.tool_functions]
+        self.tool_map = {f.__name__: f for f in self.tool_functions}
+        # Pure file tools run on the event loop with async file I/O instead of the thread pool
+        self.async_tool_map = {"read_file": read_file_async}
+        if self.verbose:
+            self.async_tool_map = {name: self._make_verbose_tool(f) for name, f in self.async_tool_map.items()}
+        self._tool_executor = None  # Thread pool for tool calls, created per session in _init_chat
         self.client = None
         self.chat = None
-        self.conversation_history = []  # Manual history for token counting ONLY
-        self.current_token_count = 0  # Store token count for the next prompt
+        self.cache_name = None  # Name of the CachedContent holding the tool declarations, if any
+        self._cache_expires_at = 0.0  # time.monotonic() at which the context cache runs out
+        self.current_token_count = 0  # Store token count for the next prompt (from usage_metadata)
+        self._uncounted_contents = []  # Messages still to be counted when a reply had no usage_metadata
         self.active_files = []  # List to store active File objects
-        self._configure_client()
+        self.response_cache = None  # LLMCache for the session, only used with a zero thinking budget
+        # Prompt pieces; the full prompt is only rebuilt when the token or file count changes
+        self._prompt_pre = "\n🔵 You ("
+        self._prompt_post = "): "
+        self._prompt_cache = (None, "")
+        # Last plain (tool-free) exchange, so an identical follow-up prompt is answered from memory
+        self._last_user = None
+        self._last_agent_text = None
+        # Per-message token counts keyed by content hash (LRU order), so a message is never counted twice
+        self._token_counts = collections.OrderedDict()
 
     def _configure_client(self):
-        """Configures the Google Generative AI client."""
+        """Configures the Google Generative AI client.
+
+        Must run on the event loop the client is used from; see _get_client.
+        """
         print("\n\u2692\ufe0f Configuring genai client...")
         try:
-            # Configure the client with our API key
-            self.client = genai.Client(api_key=self.api_key)
+            # Configure the client with our API key (shared by all agents using that key on this loop)
+            self.client = _get_client(self.api_key)
             print("\u2705 Client configured successfully.")
         except Exception as e:
             print(f"\u274c Error configuring genai client: {e}")
             traceback.print_exc()
             sys.exit(1)
 
-    def start_interaction(self):
-        """Starts the main interaction loop using a stateful ChatSession via client.chats.create."""
+    async def start_interaction(self):
+        """Starts the main interaction loop using a stateful async ChatSession via client.aio.chats.create."""
+        self._configure_client()
         if not self.client:
             print("\n\u274c Client not configured. Exiting.")
             return
 
+        await self._init_chat()
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.patch_stdout import patch_stdout
+
+        prompt_session = PromptSession()
+
+        _write(
+            "\n\u2692\ufe0f Agent ready. Ask me anything. Type '/exit' or '/q' to quit.\n"
+            "   Use '/upload <path/to/file.pdf>' to seed PDF into context.\n"
+            "   Use '/reset' to clear the chat and start fresh.\n"
+        )
+
+        # Route output written while a prompt is shown above it, instead of through the prompt line
+        with patch_stdout(raw=True):
+            # Prompt for thinking budget per session
+            try:
+                budget_input = (
+                    await prompt_session.prompt_async(
+                        f"Enter thinking budget (0 to 24000) for this session [{DEFAULT_THINKING_BUDGET}]: "
+                    )
+                ).strip()
+                self.thinking_budget = int(budget_input) if budget_input else DEFAULT_THINKING_BUDGET
+            except ValueError:
+                print(f"⚠️ Invalid thinking budget. Using default of {DEFAULT_THINKING_BUDGET}.")
+                self.thinking_budget = DEFAULT_THINKING_BUDGET
+            # The config is built once here and reused for every message in the session.
+            tool_config = await self._prepare_session_config()
+            # Replies are only (near-)deterministic without thinking, so only cache those
+            if self.use_cache and self.thinking_budget == 0:
+                from src.llm_cache import LLMCache
+
+                self.response_cache = LLMCache()
+
+            while True:
+                try:
+                    # Count any tokens still pending from the last turn while the user types,
+                    # then redraw the prompt so it shows the updated count
+                    token_task = asyncio.create_task(self._maybe_update_tokens())
+                    token_task.add_done_callback(lambda _: prompt_session.app.invalidate())
+                    try:
+                        # The prompt is passed as a callable, so every redraw shows the current
+                        # token count from the *previous* turn and the number of active files
+                        user_input = (await prompt_session.prompt_async(self._prompt_text)).strip()
+                    finally:
+                        await token_task
+
+                    if user_input.lower() in ["exit", "quit", "/exit", "/quit", "/q"]:
+                        print("\n👋 Goodbye!")
+                        break
+                    if not user_input:
+                        continue
+
+                    # --- Handle User Commands ---
+                    if user_input.lower().startswith("/upload "):
+                        pdf_path_str = user_input[len("/upload ") :].strip()
+                        if pdf_path_str:
+                            # Make sure genai is configured before calling upload
+                            if not self.client:
+                                self._configure_client()
+                                if not self.client:
+                                    print("\n\u274c Cannot upload: genai client not configured.")
+                                    continue  # Skip to next loop iteration
+                            # Call the upload function (which prints status)
+                            from src.tools import upload_pdf_for_gemini
+
+                            uploaded_file = await asyncio.to_thread(upload_pdf_for_gemini, pdf_path_str)
+                            if uploaded_file:
+                                print("\n⚒️ Extracting text from PDF to seed context...")
+                                extraction_response = await self._send_message(
+                                    message=[
+                                        uploaded_file,
+                                        "\n\nExtract the entire text of this PDF, organized by section. Include all tables, and figures (full descriptions where appropriate in place of images).",
+                                    ],
+                                    config=tool_config,
+                                )
+                                self._update_token_count(
+                                    extraction_response, [extraction_response.candidates[0].content]
+                                )
+                                # Stop attaching the file after ingestion
+                                self.active_files = []
+                                self._last_user = self._last_agent_text = None
+                                print("\n✅ PDF context seeded.")
+                            # No else needed, upload_pdf_for_gemini prints errors
+                        else:
+                            print("\n⚠️ Usage: /upload <relative/path/to/your/file.pdf>")
+                        continue  # Skip sending this command to the model
+
+                    elif user_input.lower() == "/reset":
+                        print("\n🎯 Resetting context and starting a new chat session...")
+                        self.chat = self.client.aio.chats.create(model=self.model_name, history=[])
+                        self.current_token_count = 0
+                        self._uncounted_contents = []
+                        self._last_user = self._last_agent_text = None
+                        print("\n✅ Chat session and history cleared.")
+                        continue  # Skip sending this command to the model
+
+                    # --- Same prompt as last turn: repeat the previous answer without a request ---
+                    if user_input == self._last_user and not self.active_files:
+                        _write(f"{AGENT_PREFIX}{self._last_agent_text}\n")
+                        continue
+
+                    # --- Prepare message content (Text + Files) ---
+                    message_content = [user_input]  # Start with user text
+                    if self.active_files:
+                        message_content.extend(self.active_files)  # Add file objects
+                        if self.verbose:
+                            attached = "".join(f"\n   - {f.display_name} ({f.name})" for f in self.active_files)
+                            _write(f"\n📎 Attaching {len(self.active_files)} files to the prompt:{attached}\n")
+
+                    # --- Check the response cache (text-only prompts) ---
+                    user_content = self._types.Content(parts=[self._types.Part(text=user_input)], role="user")
+                    history = self.chat.get_history(curated=True)
+                    cache_key = None
+                    if self.response_cache and not self.active_files:
+                        cache_key = self._response_cache_key(history, user_content)
+                        cached = self.response_cache.get(cache_key)
+                        if cached:
+                            self._replay_cached_turn(history, user_content, cached)
+                            self._last_user, self._last_agent_text = user_input, cached["text"]
+                            continue
+
+                    # --- Send Message ---
+                    print("\n⏳ Sending message and processing...")
+                    # Send message (and resolve any tool calls) through the chat session
+                    # Pass the potentially combined list of text and files
+                    # Reply text is printed as it streams in
+                    response = await self._send_message(
+                        message=message_content,  # Pass the list here
+                        config=tool_config,
+                        echo=True,
+                    )
+
+                    # --- Extract response text AFTER response ---
+                    response_text = ""  # Initialize empty response text
+                    new_contents = [user_content]
+                    if response.candidates and response.candidates[0].content:
+                        agent_response_content = response.candidates[0].content
+                        # Ensure we extract text even if other parts exist (e.g., tool calls)
+                        if agent_response_content.parts:
+                            response_text = " ".join(p.text for p in agent_response_content.parts if p.text)
+                        new_contents.append(agent_response_content)
+                    if not response_text:
+                        print("\n⚠️ Agent response did not contain any text.")
+
+                    # Store token count for the *next* prompt
+                    self._update_token_count(response, new_contents)
+
+                    # Remember/cache plain question/answer turns only; turns that ran tools had
+                    # side effects that a replay would silently skip
+                    is_plain_turn = len(self.chat.get_history(curated=True)) - len(history) == 2
+                    if not is_plain_turn:
+                        # The model has seen the full tool output this turn; later turns only need a summary
+                        self._compact_chat_history()
+                    if is_plain_turn and response_text:
+                        self._last_user, self._last_agent_text = user_input, response_text
+                    else:
+                        self._last_user = self._last_agent_text = None
+                    if cache_key and response_text and is_plain_turn:
+                        self.response_cache.set(
+                            cache_key,
+                            {
+                                "content": agent_response_content.model_dump(mode="json", exclude_none=True),
+                                "text": response_text,
+                                "total_token_count": self.current_token_count,
+                            },
+                        )
+
+                except (KeyboardInterrupt, EOFError, asyncio.CancelledError):
+                    # Ctrl+C surfaces as a cancellation of this task when running under asyncio.run
+                    print("\n👋 Goodbye!")
+                    break
+                except Exception as e:
+                    _write(f"{ERR_PREFIX}An error occurred during interaction: {e}{ANSI_RESET}\n")
+                    traceback.print_exc()  # Print traceback for debugging
+
+        await self._end_session()
+
+    def _compact_chat_history(self):
+        """Summarizes large tool results in the chat history, so later requests re-send less."""
+        compacted, changed = _compact_tool_results(self.chat.get_history(curated=True))
+        if changed:
+            self.chat = self.client.aio.chats.create(model=self.model_name, history=compacted)
+
+    def _prompt_text(self):
+        """Returns the input prompt, showing the token count and number of active files."""
+        state = (self.current_token_count, len(self.active_files))
+        if self._prompt_cache[0] != state:
+            files_info = f" [{state[1]} files]" if state[1] else ""
+            self._prompt_cache = (state, "".join((self._prompt_pre, str(state[0]), files_info, self._prompt_post)))
+        return self._prompt_cache[1]
+
+    def _response_cache_key(self, history, user_content):
+        """Builds the response cache key for sending ``user_content`` after ``history``."""
+        messages = [c.model_dump(mode="json", exclude_none=True) for c in [*history, user_content]]
+        return self.response_cache.cache_key(
+            self.model_name, messages, temperature=0, tools=[f.__name__ for f in self.tool_functions]
+        )
+
+    def _replay_cached_turn(self, history, user_content, cached):
+        """Serves a turn from the response cache and records it in the chat history."""
+        agent_content = self._types.Content.model_validate(cached["content"])
+        # Chat sessions are local objects, so recreating one with the extended history costs no request
+        self.chat = self.client.aio.chats.create(model=self.model_name, history=[*history, user_content, agent_content])
+        if cached.get("total_token_count"):
+            self.current_token_count = cached["total_token_count"]
+        cache_note = "\n\n🗄️ (served from response cache)" if self.verbose else ""
+        _write(f"{AGENT_PREFIX}{cached['text']}{cache_note}\n")
+
+    async def run_batch(self, prompts: list[str]):
+        """Answers several independent prompts with a single request instead of one per prompt."""
+        self._configure_client()
+        if not self.client:
+            print("\n\u274c Client not configured. Exiting.")
+            return
+
+        await self._init_chat()
+        self.thinking_budget = DEFAULT_THINKING_BUDGET
+        tool_config = await self._prepare_session_config()
+        try:
+            print(f"\n⏳ Sending {len(prompts)} prompts in a single request...")
+            response = await self._send_message(message=_build_batch_prompt(prompts), config=tool_config)
+            response_text = response.text or ""
+            answers = _split_numbered_answers(response_text, len(prompts))
+            if answers is None:
+                _write(
+                    "\n⚠️ Could not split the response into numbered answers; showing it in full.\n"
+                    f"{AGENT_PREFIX}{response_text}\n"
+                )
+            else:
+                _write(
+                    "".join(
+                        f"\n🔵 You [{i}]: {prompt}\n{AGENT_PREFIX}{answer}\n"
+                        for i, (prompt, answer) in enumerate(zip(prompts, answers, strict=True), start=1)
+                    )
+                )
+        except Exception as e:
+            _write(f"{ERR_PREFIX}An error occurred during batch request: {e}{ANSI_RESET}\n")
+            traceback.print_exc()
+        finally:
+            await self._end_session()
+
+    async def _end_session(self):
+        """Saves the session and releases everything held for it."""
+        self._save_session()
+        # Drop cached per-message token counts and the server-side context cache for this session
+        self._token_counts.clear()
+        await self._delete_context_cache()
+        if self.response_cache:
+            self.response_cache.close()
+            self.response_cache = None
+        if self._tool_executor:
+            self._tool_executor.shutdown(wait=False, cancel_futures=True)
+            self._tool_executor = None
+
+    async def _init_chat(self):
+        """Creates the async chat session, seeded from the session file if any, exiting on failure."""
         print("\n\u2692\ufe0f Initializing chat session...")
+        # Dedicated pool for tool calls, so a turn's calls run concurrently without
+        # competing with the event loop's default executor (input, uploads, counting).
+        # It is shut down in _end_session, so every session gets a new one.
+        self._tool_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool"
+        )
         try:
+            history = self._load_session()
             # Create a chat session using the client
-            self.chat = self.client.chats.create(model=self.model_name, history=[])
+            self.chat = self.client.aio.chats.create(model=self.model_name, history=history)
             print("\u2705 Chat session initialized.")
         except Exception as e:
             print(f"\u274c Error initializing chat session: {e}")
             traceback.print_exc()
             sys.exit(1)
-
-        print("\n\u2692\ufe0f Agent ready. Ask me anything. Type '/exit' or '/q' to quit.")
-        print("   Use '/upload <path/to/file.pdf>' to seed PDF into context.")
-        print("   Use '/reset' to clear the chat and start fresh.")
-
-        # Prompt for thinking budget per session
-        try:
-            budget_input = input(
-                f"Enter thinking budget (0 to 24000) for this session [{DEFAULT_THINKING_BUDGET}]: "
-            ).strip()
-            self.thinking_budget = int(budget_input) if budget_input else DEFAULT_THINKING_BUDGET
-        except ValueError:
-            print(f"⚠️ Invalid thinking budget. Using default of {DEFAULT_THINKING_BUDGET}.")
-            self.thinking_budget = DEFAULT_THINKING_BUDGET
-        self.thinking_config = types.ThinkingConfig(thinking_budget=self.thinking_budget)
-
-        # Prepare tool config with thinking_config
-        tool_config = types.GenerateContentConfig(tools=self.tool_functions, thinking_config=self.thinking_config)
-
-        while True:
+        if history:
+            # One request for the whole restored history; later turns use usage_metadata
             try:
-                # Display token count from *previous* turn in the prompt
-                # Also show number of active files
-                active_files_info = f" [{len(self.active_files)} files]" if self.active_files else ""
-                prompt_text = f"\n🔵 You ({self.current_token_count}{active_files_info}): "
-                user_input = input(prompt_text).strip()
-
-                if user_input.lower() in ["exit", "quit", "/exit", "/quit", "/q"]:
-                    print("\n👋 Goodbye!")
-                    break
-                if not user_input:
-                    continue
-
-                # --- Handle User Commands ---
-                if user_input.lower().startswith("/upload "):
-                    pdf_path_str = user_input[len("/upload ") :].strip()
-                    if pdf_path_str:
-                        # Make sure genai is configured before calling upload
-                        if not self.client:
-                            self._configure_client()
-                            if not self.client:
-                                print("\n\u274c Cannot upload: genai client not configured.")
-                                continue  # Skip to next loop iteration
-                        # Call the upload function (which prints status)
-                        uploaded_file = upload_pdf_for_gemini(pdf_path_str)
-                        if uploaded_file:
-                            print("\n⚒️ Extracting text from PDF to seed context...")
-                            extraction_response = self.chat.send_message(
-                                message=[
-                                    uploaded_file,
-                                    "\n\nExtract the entire text of this PDF, organized by section. Include all tables, and figures (full descriptions where appropriate in place of images).",
-                                ],
-                                config=tool_config,
-                            )
-                            extraction_content = extraction_response.candidates[0].content
-                            self.conversation_history.append(extraction_content)
-                            # Stop attaching the file after ingestion
-                            self.active_files = []
-                            print("\n✅ PDF context seeded.")
-                        # No else needed, upload_pdf_for_gemini prints errors
-                    else:
-                        print("\n⚠️ Usage: /upload <relative/path/to/your/file.pdf>")
-                    continue  # Skip sending this command to the model
-
-                elif user_input.lower() == "/reset":
-                    print("\n🎯 Resetting context and starting a new chat session...")
-                    self.chat = self.client.chats.create(model=self.model_name, history=[])
-                    self.conversation_history = []
-                    self.current_token_count = 0
-                    print("\n✅ Chat session and history cleared.")
-                    continue  # Skip sending this command to the model
-
-                # --- Prepare message content (Text + Files) ---
-                message_content = [user_input]  # Start with user text
-                if self.active_files:
-                    message_content.extend(self.active_files)  # Add file objects
-                    if self.verbose:
-                        print(f"\n📎 Attaching {len(self.active_files)} files to the prompt:")
-                        for f in self.active_files:
-                            print(f"   - {f.display_name} ({f.name})")
-
-                # --- Update manual history (for token counting ONLY - Use Text Only) ---
-                # Add user message BEFORE sending to model
-                # Store only the text part for history counting simplicity
-                new_user_content = types.Content(parts=[types.Part(text=user_input)], role="user")
-                self.conversation_history.append(new_user_content)
-
-                # --- Send Message ---
-                print("\n⏳ Sending message and processing...")
-                # Prepare tool configuration
-                tool_config = types.GenerateContentConfig(
-                    tools=self.tool_functions, thinking_config=self.thinking_config
-                )
-
-                # Send message using the chat object's send_message method
-                # Pass the potentially combined list of text and files
-                response = self.chat.send_message(
-                    message=message_content,  # Pass the list here
-                    config=tool_config,
+                token_count_response = await self.client.aio.models.count_tokens(
+                    model=self.model_name, contents=history
                 )
+                self.current_token_count = token_count_response.total_tokens
+            except Exception as count_error:
+                _write(f"{WARN_PREFIX}Could not count restored history: {count_error}{ANSI_RESET}\n")
+
+    def _load_session(self):
+        """Returns the chat history stored in the session file, or an empty list.
+
+        Restoring the exact same history keeps the request prefix byte-identical across
+        runs, which lets Gemini's prompt caching serve it instead of reprocessing it.
+        """
+        if not self.session_path or not self.session_path.is_file():
+            return []
+        import orjson
+
+        history = [self._types.Content.model_validate(c) for c in orjson.loads(self.session_path.read_bytes())]
+        print(f"\u2705 Restored {len(history)} messages from {self.session_path}")
+        return history
+
+    def _save_session(self):
+        """Writes the curated chat history to the session file, if one is configured."""
+        if not self.session_path or not self.chat:
+            return
+        import orjson
 
-                # --- Update manual history and calculate new token count AFTER response ---
-                agent_response_content = None
-                response_text = ""  # Initialize empty response text
-                if response.candidates and response.candidates[0].content:
-                    agent_response_content = response.candidates[0].content
-                    # Ensure we extract text even if other parts exist (e.g., tool calls)
-                    if agent_response_content.parts:
-                        # Simple concatenation of text parts for history
-                        response_text = " ".join(p.text for p in agent_response_content.parts if hasattr(p, "text"))
-                    self.conversation_history.append(agent_response_content)
+        try:
+            history = self.chat.get_history(curated=True)
+            self.session_path.parent.mkdir(parents=True, exist_ok=True)
+            self.session_path.write_bytes(orjson.dumps([c.model_dump(mode="json", exclude_none=True) for c in history]))
+            print(f"\n💾 Saved {len(history)} messages to {self.session_path}")
+        except Exception as e:
+            _write(f"{WARN_PREFIX}Could not save session to {self.session_path}: {e}{ANSI_RESET}\n")
+
+    async def _prepare_session_config(self):
+        """Builds the session's request config from ``self.thinking_budget``.
+
+        Registers the static tool declarations server-side once if they are large enough
+        to cache, so every request of the session can reference the cache instead of
+        re-sending them.
+        """
+        self.thinking_config = self._types.ThinkingConfig(thinking_budget=self.thinking_budget)
+        await self._create_context_cache()
+        return self._make_tool_config()
+
+    async def _create_context_cache(self):
+        """Creates an explicit context cache holding the tool declarations.
+
+        Falls back to sending the tools with every request if caching is unavailable.
+        The declarations' size is estimated first, so no request is made when they are
+        below the model's minimum cacheable size, and a model for which creating the
+        cache failed is not tried again in this process.
+        """
+        self.cache_name = None
+        if self.model_name in _uncacheable_models:
+            return
+        estimated_tokens = len(self.tool.model_dump_json(exclude_none=True)) // CHARS_PER_TOKEN
+        if estimated_tokens < CONTEXT_CACHE_MIN_TOKENS:
+            if self.verbose:
+                print(f"\n🗄️ Tool declarations (~{estimated_tokens} tokens) are too small to cache, sending them inline")
+            return
+        try:
+            cache = await self.client.aio.caches.create(
+                model=self.model_name,
+                config=self._types.CreateCachedContentConfig(
+                    tools=[self.tool],
+                    ttl=CONTEXT_CACHE_TTL,
+                ),
+            )
+            self.cache_name = cache.name
+            self._cache_expires_at = time.monotonic() + CONTEXT_CACHE_TTL_SECONDS
+            if self.verbose:
+                print(f"\n🗄️ Tool declarations cached as {self.cache_name}")
+        except Exception as e:
+            _uncacheable_models.add(self.model_name)
+            # Reported without -v as well: the declarations were expected to be cacheable
+            _write(f"{WARN_PREFIX}Context caching unavailable, sending tools with each request: {e}{ANSI_RESET}\n")
+
+    async def _refresh_context_cache(self, config):
+        """Keeps the context cache referenced by ``config`` alive for the next request.
+
+        The TTL is extended shortly before it runs out. A cache that already expired
+        (e.g. after an idle hour at the prompt) is recreated, or the tools are sent
+        inline if that fails. ``config`` is updated in place, so the session keeps
+        using a single config.
+        """
+        if not config.cached_content or time.monotonic() < self._cache_expires_at - CONTEXT_CACHE_REFRESH_SECONDS:
+            return
+        try:
+            await self.client.aio.caches.update(
+                name=self.cache_name, config=self._types.UpdateCachedContentConfig(ttl=CONTEXT_CACHE_TTL)
+            )
+            self._cache_expires_at = time.monotonic() + CONTEXT_CACHE_TTL_SECONDS
+            return
+        except Exception as e:
+            if self.verbose:
+                print(f"\n⚠️ Could not extend context cache {self.cache_name}, recreating it: {e}")
+        self.cache_name = None
+        await self._create_context_cache()
+        fresh_config = self._make_tool_config()
+        config.cached_content = fresh_config.cached_content
+        config.tools = fresh_config.tools
+
+    async def _delete_context_cache(self):
+        """Deletes the session's context cache, if one was created."""
+        if not self.cache_name:
+            return
+        try:
+            await self.client.aio.caches.delete(name=self.cache_name)
+        except Exception as e:
+            print(f"\n⚠️ Could not delete context cache {self.cache_name}: {e}")
+        self.cache_name = None
+
+    def _make_tool_config(self):
+        """Builds the GenerateContentConfig, referencing the context cache when available."""
+        if self.cache_name:
+            return self._types.GenerateContentConfig(
+                cached_content=self.cache_name, thinking_config=self.thinking_config
+            )
+        return self._types.GenerateContentConfig(
+            tools=[self.tool],
+            thinking_config=self.thinking_config,
+        )
+
+    async def _send_message(self, message, config, echo: bool = False):
+        """Sends a message through the chat session and resolves any function calls.
+
+        Tools are declared to the model rather than passed as callables (they may live in
+        the context cache), so the SDK's automatic function calling does not run them.
+        The responses of a round are sent back together in a single message. With
+        ``echo``, reply text is printed as it streams in.
+        """
+        response = await self._stream_message(message, config, echo)
+        for _ in range(MAX_REMOTE_CALLS):
+            if not response.function_calls:
+                break
+            function_responses = await self._call_tools(response.function_calls)
+            response = await self._stream_message(function_responses, config, echo)
+        else:
+            if response.function_calls:
+                _write(f"{WARN_PREFIX}Stopped after {MAX_REMOTE_CALLS} rounds of tool calls.{ANSI_RESET}\n")
+        return response
+
+    async def _stream_message(self, message, config, echo: bool):
+        """Streams one model reply and folds the chunks back into a single response.
+
+        Returns a GenerateContentResponse holding the full text, any function calls and
+        the usage metadata of the final chunk, so callers can treat it like a
+        non-streamed reply.
+        """
+        await self._refresh_context_cache(config)
+        text_chunks = []
+        function_call_parts = []
+        usage_metadata = None
+        async for chunk in await self.chat.send_message_stream(message=message, config=config):
+            if chunk.usage_metadata:
+                usage_metadata = chunk.usage_metadata
+            if not (chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts):
+                continue
+            for part in chunk.candidates[0].content.parts:
+                if part.function_call:
+                    function_call_parts.append(part)
+                elif part.text and not part.thought:
+                    if echo:
+                        _write(part.text if text_chunks else f"{AGENT_PREFIX}{part.text}")
+                    text_chunks.append(part.text)
+        if echo and text_chunks:
+            _write("\n")
+
+        parts = [self._types.Part(text="".join(text_chunks))] if text_chunks else []
+        parts.extend(function_call_parts)
+        return self._types.GenerateContentResponse(
+            candidates=[self._types.Candidate(content=self._types.Content(role="model", parts=parts))],
+            usage_metadata=usage_metadata,
+        )
+
+    async def _call_tools(self, function_calls):
+        """Runs one round of tool calls and returns their responses in call order.
+
+        Consecutive read-only calls run concurrently. Any other call (file edits, shell
+        and sandbox commands) runs on its own, after every call before it has finished,
+        so the tools see the effects in the order the model asked for them.
+        """
+        function_responses = []
+        pending_reads = []
+        for function_call in function_calls:
+            if function_call.name in READ_ONLY_TOOLS:
+                pending_reads.append(function_call)
+                continue
+            function_responses.extend(await asyncio.gather(*(self._call_tool(call) for call in pending_reads)))
+            pending_reads = []
+            function_responses.append(await self._call_tool(function_call))
+        function_responses.extend(await asyncio.gather(*(self._call_tool(call) for call in pending_reads)))
+        return function_responses
+
+    async def _call_tool(self, function_call):
+        """Runs a single tool call and wraps its outcome in a function response Part.
+
+        Tools with an async implementation are awaited directly; all others run on the
+        tool thread pool.
+        """
+        args = function_call.args or {}
+        async_func = self.async_tool_map.get(function_call.name)
+        func = self.tool_map.get(function_call.name)
+        if async_func is None and func is None:
+            response = {"error": f"Unknown tool: {function_call.name}"}
+        else:
+            try:
+                if async_func is not None:
+                    result = await async_func(**args)
                 else:
-                    print("\n⚠️ Agent response did not contain content for history/counting.")
-
-                # Print agent's response text to user
-                # Use the extracted response_text or response.text as fallback
-                print(f"\n🟢 \x1b[92mAgent:\x1b[0m {response_text or response.text}")
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(self._tool_executor, functools.partial(func, **args))
+                response = {"result": result}
+            except Exception as e:
+                response = {"error": str(e)}
+        return self._types.Part.from_function_response(name=function_call.name, response=response)
+
+    def _update_token_count(self, response, new_contents):
+        """Updates the running token count after a response.
+
+        The total reported in the response's usage metadata already covers the whole
+        context sent with the request plus the reply, so it is used when present.
+        Otherwise the new messages of this turn are queued for _maybe_update_tokens,
+        which counts them in the background while the user types the next prompt.
+        """
+        usage = getattr(response, "usage_metadata", None)
+        if usage and usage.total_token_count:
+            self.current_token_count = usage.total_token_count
+            self._uncounted_contents = []
+            return
+        self._uncounted_contents.extend(new_contents)
 
-                # Calculate and store token count for the *next* prompt
-                try:
-                    # Get token count via the models endpoint
-                    token_count_response = self.client.models.count_tokens(
-                        model=self.model_name, contents=self.conversation_history
-                    )
-                    self.current_token_count = token_count_response.total_tokens
-                except Exception as count_error:
-                    # Don't block interaction if counting fails, just report it and keep old count
-                    print(f"\n⚠️ \x1b[93mCould not update token count: {count_error}\x1b[0m")
+    async def _maybe_update_tokens(self):
+        """Adds the token counts of queued messages to the running total.
 
-            except KeyboardInterrupt:
-                print("\n👋 Goodbye!")
-                break
-            except Exception as e:
-                print(f"\n🔴 \x1b[91mAn error occurred during interaction: {e}\x1b[0m")
-                traceback.print_exc()  # Print traceback for debugging
+        Each message is counted at most once (via the content-hash cache).
+        """
+        if not self._uncounted_contents:
+            return
+        contents, self._uncounted_contents = self._uncounted_contents, []
+        try:
+            self.current_token_count += await asyncio.to_thread(self._count_contents, contents)
+        except Exception as count_error:
+            # Don't block interaction if counting fails, just report it and keep old count
+            _write(f"{WARN_PREFIX}Could not update token count: {count_error}{ANSI_RESET}\n")
+
+    def _count_contents(self, contents) -> int:
+        """Sums the (cached) token counts of the given Contents."""
+        total = 0
+        for content in contents:
+            total += self._count_content(_content_hash(_serialize_content(content)), content)
+        return total
+
+    def _count_content(self, content_hash: str, content) -> int:
+        """Returns the token count of a single Content, cached by its content hash.
+
+        Only the hash is kept as the key, so the cache holds one digest and count per
+        message rather than its serialized bytes. The least recently used count is
+        dropped beyond TOKEN_COUNT_CACHE_SIZE entries.
+        """
+        if content_hash in self._token_counts:
+            self._token_counts.move_to_end(content_hash)
+            return self._token_counts[content_hash]
+        total_tokens = self._count_content_uncached(content)
+        self._token_counts[content_hash] = total_tokens
+        if len(self._token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            self._token_counts.popitem(last=False)
+        return total_tokens
+
+    def _count_content_uncached(self, content) -> int:
+        """Counts the tokens of a single Content via the models endpoint."""
+        token_count_response = self.client.models.count_tokens(model=self.model_name, contents=[content])
+        return token_count_response.total_tokens
 
     def _make_verbose_tool(self, func):
-        """Wrap tool function to print verbose info when called."""
+        """Wrap tool function (sync or async) to print verbose info when called."""
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                _write(f"\n🔧 Tool called: {func.__name__}, args: {args}, kwargs: {kwargs}\n")
+                result = await func(*args, **kwargs)
+                _write(f"\n▶️ Tool result ({func.__name__}): {result}\n")
+                return result
+
+            return async_wrapper
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            print(f"\n🔧 Tool called: {func.__name__}, args: {args}, kwargs: {kwargs}")
+            _write(f"\n🔧 Tool called: {func.__name__}, args: {args}, kwargs: {kwargs}\n")
             result = func(*args, **kwargs)
-            print(f"\n▶️ Tool result ({func.__name__}): {result}")
+            _write(f"\n▶️ Tool result ({func.__name__}): {result}\n")
             return result
 
         return wrapper
@@ -240,6 +847,21 @@ class CodeAgent:
 def main():
     parser = argparse.ArgumentParser(description="Run the Code Agent")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose tool logging")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Disable the on-disk response cache for repeated prompts"
+    )
+    parser.add_argument(
+        "--session",
+        type=Path,
+        help="Restore the chat history from PATH on start and save it back on exit",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        help="Answer the prompts in FILE (one per line) with a single request, then exit",
+        metavar="FILE",
+    )
     args = parser.parse_args()
     print("🚀 Starting Code Agent...")
     # api_key = os.getenv('GEMINI_API_KEY')
@@ -249,10 +871,16 @@ def main():
         sys.exit(1)
     print("🔑 API Key found.")
 
-    # Make project_root available to the tools module if needed indirectly
-    # (Though direct definition in tools.py is preferred)
-    # import src.tools
-    # src.tools.project_root = project_root
+    batch_prompts = None
+    if args.batch:
+        try:
+            batch_prompts = [line.strip() for line in args.batch.read_text().splitlines() if line.strip()]
+        except OSError as e:
+            print(f"⚠️ Could not read batch file {args.batch}: {e}")
+            sys.exit(1)
+        if not batch_prompts:
+            print(f"⚠️ Batch file {args.batch} contains no prompts.")
+            sys.exit(1)
 
     # Configure logging level based on verbose flag
     level = logging.DEBUG if args.verbose else logging.WARNING
@@ -263,10 +891,23 @@ def main():
     logging.getLogger("agent").setLevel(level)
     logging.getLogger("controller").setLevel(level)
 
-    agent = CodeAgent(api_key=api_key, model_name=MODEL_NAME, verbose=args.verbose)
+    agent = CodeAgent(
+        api_key=api_key,
+        model_name=MODEL_NAME,
+        verbose=args.verbose,
+        use_cache=not args.no_cache,
+        session_path=args.session,
+    )
     # Ensure agent's client is configured before starting interaction
     # This happens inside start_interaction now
-    agent.start_interaction()
+    try:
+        if batch_prompts:
+            asyncio.run(agent.run_batch(batch_prompts))
+        else:
+            asyncio.run(agent.start_interaction())
+    except KeyboardInterrupt:
+        # asyncio.run re-raises Ctrl+C after the interaction loop has shut down cleanly
+        pass
 
 
 if __name__ == "__main__":
@@ -38,17 +38,24 @@ def _check_docker_running() -> tuple[bool, docker.DockerClient | None, str]:
         # Catch other potential issues like docker library not installed
         return False, None, f"Error checking Docker status: {e}"
 
+def _resolve_readable_file(path: str) -> tuple[Path | None, str]:
+    """Resolves a path relative to the project root for reading, or returns an error message."""
+    # Security check: Ensure path is within the project directory
+    target_path = (project_root / path).resolve()
+    if not target_path.is_relative_to(project_root):
+        return None, "Error: Access denied. Path is outside the project directory."
+    if not target_path.is_file():
+        return None, f"Error: File not found at {path}"
+    return target_path, ""
+
 # --- Tool Functions ---
 def read_file(path: str) -> str:
     """Reads the content of a file at the given path."""
     print(f"\n\u2692\ufe0f Tool: Reading file: {path}")
     try:
-        # Security check: Ensure path is within the project directory
-        target_path = (project_root / path).resolve()
-        if not target_path.is_relative_to(project_root):
-            return "Error: Access denied. Path is outside the project directory."
-        if not target_path.is_file():
-            return f"Error: File not found at {path}"
+        target_path, error = _resolve_readable_file(path)
+        if target_path is None:
+            return error
         return target_path.read_text()
     except Exception as e:
         return f"Error reading file: {e}"
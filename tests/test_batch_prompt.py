@@ -0,0 +1,28 @@
+from src.main import _build_batch_prompt, _split_numbered_answers
+
+
+def test_build_batch_prompt_numbers_each_prompt():
+    prompt = _build_batch_prompt(["What is 2+2?", "Name a prime."])
+
+    assert prompt.endswith("\n1. What is 2+2?\n2. Name a prime.")
+
+
+def test_split_numbered_answers_round_trip():
+    text = "Sure, here you go.\n1. Four.\n2) Seven,\nwhich is prime.\n"
+
+    assert _split_numbered_answers(text, 2) == ["Four.", "Seven,\nwhich is prime."]
+
+
+def test_split_numbered_answers_rejects_mismatched_numbering():
+    assert _split_numbered_answers("1. Four.\n3. Seven.", 2) is None
+    assert _split_numbered_answers("1. Four.", 2) is None
+    assert _split_numbered_answers("No numbers at all.", 1) is None
+
+
+def test_split_numbered_answers_keeps_nested_lists_in_their_answer():
+    indented = "1. Steps:\n   1. a\n   2. b\n2. Done"
+    unindented = "1. Steps:\n1. a\n2. b\n2. Done"
+
+    assert _split_numbered_answers(indented, 2) == ["Steps:\n   1. a\n   2. b", "Done"]
+    assert _split_numbered_answers(unindented, 2) == ["Steps:\n1. a\n2. b", "Done"]
+    assert _split_numbered_answers("1. One\n2. Steps:\n1. a\n2. b\n3. c", 2) == ["One", "Steps:\n1. a\n2. b\n3. c"]
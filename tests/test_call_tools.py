@@ -0,0 +1,59 @@
+import asyncio
+import concurrent.futures
+import threading
+from types import SimpleNamespace
+
+from src.main import CodeAgent
+
+
+def _make_agent(log):
+    """Builds a CodeAgent with stub read/edit tools, without a client or the Gemini SDK."""
+    # Both first reads must be running at the same time to get past the barrier
+    first_reads = threading.Barrier(2, timeout=5)
+
+    def read_file(path):
+        log.append(("start", path))
+        if path in ("a", "b"):
+            first_reads.wait()
+        log.append(("end", path))
+        return path
+
+    def edit_file(path, content):
+        log.append(("start", path))
+        log.append(("end", path))
+        return content
+
+    agent = CodeAgent.__new__(CodeAgent)
+    agent.tool_map = {"read_file": read_file, "edit_file": edit_file}
+    agent.async_tool_map = {}
+    agent._tool_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    agent._types = SimpleNamespace(Part=SimpleNamespace(from_function_response=lambda name, response: (name, response)))
+    return agent
+
+
+def _call(name, **args):
+    return SimpleNamespace(name=name, args=args)
+
+
+def test_call_tools_runs_writes_alone_in_call_order():
+    log = []
+    agent = _make_agent(log)
+    calls = [
+        _call("read_file", path="a"),
+        _call("read_file", path="b"),
+        _call("edit_file", path="x", content="new"),
+        _call("read_file", path="c"),
+    ]
+
+    responses = asyncio.run(agent._call_tools(calls))
+    agent._tool_executor.shutdown()
+
+    assert responses == [
+        ("read_file", {"result": "a"}),
+        ("read_file", {"result": "b"}),
+        ("edit_file", {"result": "new"}),
+        ("read_file", {"result": "c"}),
+    ]
+    # The edit starts only after both earlier reads finished, and the later read waits for the edit
+    assert log.index(("start", "x")) > max(log.index(("end", "a")), log.index(("end", "b")))
+    assert log.index(("start", "c")) > log.index(("end", "x"))